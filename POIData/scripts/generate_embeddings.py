@@ -10,6 +10,7 @@ This script:
 Requirements:
 - Python 3.7+
 - openai library (pip install openai)
+- orjson library (pip install orjson)
 
 Usage:
 1. Set your OpenAI API key in the environment: export OPENAI_API_KEY=your_key_here
@@ -19,18 +20,23 @@ Usage:
 """
 
 import os
+import asyncio
 import json
 import glob
+import hashlib
 import re
+import shelve
 import time
 import uuid
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Tuple
 import argparse
 import numpy as np
+import orjson
 import gzip
+import lzma
 
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI, RateLimitError
 
 load_dotenv()
 
@@ -40,9 +46,20 @@ CONFIG = {
     "poi_dir": "POIData",                         # Directory containing POI text files
     "output_file": "poi_embeddings.json",         # Output file for embeddings
     "separator": "---",                           # Separator between POIs in text files
-    "delay": 0.1,                                 # Delay between API calls (to avoid rate limits)
+    "batch_size": 96,                             # Number of POIs sent per embeddings request
+    "concurrency": 16,                            # Maximum embeddings requests in flight
+    "rpm": 3000,                                  # Requests per minute allowed for the model
+    "tpm": 1000000,                               # Tokens per minute allowed for the model
+    "max_retries": 5,                             # Retries per request when rate limited
+    "retry_delay": 1.0,                           # Initial backoff delay in seconds (doubles per retry)
+    "batch_poll_interval": 30,                    # Seconds between Batch API status checks
+    "cache_path": os.path.expanduser("~/.cache/poi_embeddings.db"),  # On-disk embedding cache
+    "cache_flush_every": 50,                      # Flush the cache after this many new embeddings
 }
 
+# Matches "latitude: <lat>, longitude: <lon>" in POI text
+_LOC_RE = re.compile(r"latitude: ([-\d.]+), longitude: ([-\d.]+)")
+
 # Point of Interest data model
 class PointOfInterest:
     def __init__(self, content: str, location: Optional[Dict[str, float]] = None, embedding: Optional[List[float]] = None):
@@ -63,8 +80,7 @@ class PointOfInterest:
 
 def extract_location(text: str) -> Optional[Dict[str, float]]:
     """Extract latitude and longitude from text if present."""
-    pattern = r"latitude: ([-\d.]+), longitude: ([-\d.]+)"
-    match = re.search(pattern, text)
+    match = _LOC_RE.search(text)
     if match:
         try:
             return {
@@ -103,104 +119,347 @@ def parse_poi_file(file_path: str) -> List[PointOfInterest]:
         print(f"Error parsing {file_path}: {e}")
         return []
 
-def generate_embedding(text: str, client: OpenAI) -> List[float]:
-    """Generate embedding for a text using OpenAI API."""
-    try:
-        response = client.embeddings.create(
-            input=text,
-            model=CONFIG["embedding_model"]
-        )
-        return response.data[0].embedding
-    except Exception as e:
-        print(f"Error generating embedding: {e}")
-        return []
-
-def generate_embeddings_for_pois(pois: List[PointOfInterest]) -> List[PointOfInterest]:
-    """Generate embeddings for each POI."""
-    client = OpenAI()
+class RateLimiter:
+    """Token bucket limiting requests and tokens per minute across concurrent tasks."""
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = float(rpm)
+        self.tokens = float(tpm)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
     
-    processed_pois = []
-    for i, poi in enumerate(pois):
-        if i % 5 == 0:
-            print(f"Processing POI {i+1}/{len(pois)}")
-        
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.updated = now
+        self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60)
+        self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60)
+    
+    async def acquire(self, tokens: int) -> None:
+        """Wait until one request using `tokens` tokens fits within the limits."""
+        tokens = min(tokens, self.tpm)
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.requests >= 1 and self.tokens >= tokens:
+                    self.requests -= 1
+                    self.tokens -= tokens
+                    return
+                wait = max((1 - self.requests) * 60 / self.rpm, (tokens - self.tokens) * 60 / self.tpm)
+                await asyncio.sleep(wait)
+
+def estimate_token_count(text: str) -> int:
+    """Roughly estimate token count from text."""
+    return len(text) // 4 + 1
+
+async def generate_embeddings(texts: List[str], client: AsyncOpenAI, limiter: RateLimiter) -> List[List[float]]:
+    """Generate embeddings for a list of texts in a single OpenAI API call.
+
+    Retries with exponential backoff when the API rate limits the request.
+    """
+    tokens = sum(estimate_token_count(text) for text in texts)
+    for attempt in range(CONFIG["max_retries"]):
+        await limiter.acquire(tokens)
         try:
-            # Generate embedding
-            embedding = generate_embedding(poi.content, client)
-            
-            # Create new POI with embedding
-            processed_poi = PointOfInterest(
-                content=poi.content,
-                location={"latitude": poi.latitude, "longitude": poi.longitude} if poi.latitude and poi.longitude else None,
-                embedding=embedding
+            response = await client.embeddings.create(
+                input=texts,
+                model=CONFIG["embedding_model"]
             )
-            processed_pois.append(processed_poi)
+            # Restore input order in case the API returns results out of order
+            return [d.embedding for d in sorted(response.data, key=lambda d: d.index)]
+        except RateLimitError as e:
+            if attempt == CONFIG["max_retries"] - 1:
+                raise
+            delay = CONFIG["retry_delay"] * (2 ** attempt)
+            print(f"Rate limited ({e}), retrying in {delay:.1f}s...")
+            await asyncio.sleep(delay)
+
+def embedding_cache_key(text: str) -> str:
+    """Key for a text's embedding in the on-disk cache."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest() + ":" + CONFIG["embedding_model"]
+
+async def generate_embeddings_for_pois(pois: List[PointOfInterest], use_cache: bool = True) -> List[PointOfInterest]:
+    """Generate embeddings for each POI, sending batched API calls concurrently.
+
+    POIs with identical content share one embedding, so each distinct text
+    is only sent to the API once. With use_cache, embeddings are also kept
+    in an on-disk cache so a rerun only requests texts it has not seen.
+    """
+    client = AsyncOpenAI()
+    semaphore = asyncio.Semaphore(CONFIG["concurrency"])
+    limiter = RateLimiter(CONFIG["rpm"], CONFIG["tpm"])
+    batch_size = CONFIG["batch_size"]
+    
+    unique_texts = list(dict.fromkeys(poi.content for poi in pois))
+    if len(unique_texts) < len(pois):
+        print(f"Skipping {len(pois) - len(unique_texts)} POIs with duplicate content")
+    embeddings_by_text = {}
+    
+    cache = None
+    if use_cache:
+        os.makedirs(os.path.dirname(CONFIG["cache_path"]), exist_ok=True)
+        cache = shelve.open(CONFIG["cache_path"])
+    try:
+        if cache is not None:
+            for text in unique_texts:
+                key = embedding_cache_key(text)
+                if key in cache:
+                    embeddings_by_text[text] = cache[key]
+            if embeddings_by_text:
+                print(f"Loaded {len(embeddings_by_text)} embeddings from cache")
+        
+        missing_texts = [text for text in unique_texts if text not in embeddings_by_text]
+        chunks = [missing_texts[start:start + batch_size] for start in range(0, len(missing_texts), batch_size)]
+        completed = 0
+        unflushed = 0
+        
+        async def process_chunk(chunk: List[str]) -> None:
+            nonlocal completed, unflushed
+            async with semaphore:
+                embeddings = await generate_embeddings(chunk, client, limiter)
             
-            # Sleep to avoid API rate limits
-            time.sleep(CONFIG["delay"])
+            embeddings_by_text.update(zip(chunk, embeddings))
+            if cache is not None:
+                for text, embedding in zip(chunk, embeddings):
+                    cache[embedding_cache_key(text)] = embedding
+                unflushed += len(chunk)
+                if unflushed >= CONFIG["cache_flush_every"]:
+                    cache.sync()
+                    unflushed = 0
             
-            if (i+1) % 10 == 0:
-                print(f"Completed {i+1}/{len(pois)} POIs")
-                
-        except Exception as e:
-            print(f"Error processing POI: {e}")
-            # Add POI without embedding
-            processed_pois.append(poi)
+            completed += len(chunk)
+            print(f"Completed {completed}/{len(missing_texts)} uncached POIs")
+        
+        results = await asyncio.gather(*[process_chunk(chunk) for chunk in chunks], return_exceptions=True)
+        
+        for chunk, result in zip(chunks, results):
+            if isinstance(result, Exception):
+                # POIs in a failed chunk are kept without embedding
+                print(f"Error processing {len(chunk)} POIs: {result}")
+    finally:
+        if cache is not None:
+            cache.close()
     
-    return processed_pois
+    for poi in pois:
+        poi.embedding = embeddings_by_text.get(poi.content)
+    
+    return pois
 
-def optimize_embedding(embedding: List[float], decimals: int = 2) -> List[float]:
-    """Quantize embedding values to reduce size while maintaining accuracy."""
-    return [round(x, decimals) for x in embedding]
+def generate_embeddings_batch_api(pois: List[PointOfInterest]) -> List[PointOfInterest]:
+    """Generate embeddings for each POI using the OpenAI Batch API.
 
-def compress_json(data: str) -> bytes:
-    """Compress JSON string using gzip."""
-    return gzip.compress(data.encode('utf-8'))
+    All POIs go into one job with one request per POI, and the embeddings
+    are joined back to the POIs by their id once the job has finished.
+    """
+    client = OpenAI()
+    
+    # One embeddings request per POI, keyed by the POI id
+    lines = []
+    for poi in pois:
+        request = {
+            "custom_id": poi.id,
+            "method": "POST",
+            "url": "/v1/embeddings",
+            "body": {"model": CONFIG["embedding_model"], "input": poi.content}
+        }
+        lines.append(json.dumps(request, ensure_ascii=False))
+    batch_input = "\n".join(lines).encode('utf-8')
+    
+    input_file = client.files.create(file=("poi_embeddings_batch.jsonl", batch_input), purpose="batch")
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/embeddings",
+        completion_window="24h"
+    )
+    print(f"Submitted batch {batch.id} with {len(pois)} requests")
+    
+    # Wait for the batch to finish
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        time.sleep(CONFIG["batch_poll_interval"])
+        batch = client.batches.retrieve(batch.id)
+        counts = batch.request_counts
+        completed = counts.completed if counts else 0
+        print(f"Batch {batch.id} status: {batch.status} ({completed}/{len(pois)} completed)")
+    
+    if batch.status != "completed" or not batch.output_file_id:
+        print(f"Error: batch {batch.id} finished with status {batch.status}")
+        return pois
+    
+    # Join embeddings back onto the POIs by custom_id
+    embeddings = {}
+    output = client.files.content(batch.output_file_id).text
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        result = json.loads(line)
+        response = result.get("response")
+        if result.get("error") or not response or response.get("status_code") != 200:
+            print(f"Error generating embedding for POI {result.get('custom_id')}: {result.get('error')}")
+            continue
+        embeddings[result["custom_id"]] = response["body"]["data"][0]["embedding"]
+    
+    for poi in pois:
+        poi.embedding = embeddings.get(poi.id)
+    
+    print(f"Received embeddings for {len(embeddings)}/{len(pois)} POIs")
+    return pois
+
+def optimize_embeddings(embeddings: np.ndarray, decimals: int = 2) -> np.ndarray:
+    """Quantize an (N, D) embedding matrix to reduce size while maintaining accuracy."""
+    return np.round(embeddings, decimals)
+
+# File suffix for each supported compression codec
+CODEC_SUFFIXES = {"gzip": ".gz", "zstd": ".zst", "lzma": ".xz"}
+
+def compress_json(data: bytes, codec: str = "gzip") -> bytes:
+    """Compress UTF-8 encoded JSON using gzip, zstd or lzma."""
+    if codec == "gzip":
+        return gzip.compress(data)
+    if codec == "zstd":
+        import zstandard  # only needed for zstd output (pip install zstandard)
+        return zstandard.ZstdCompressor(level=19).compress(data)
+    if codec == "lzma":
+        return lzma.compress(data, preset=9 | lzma.PRESET_EXTREME)
+    raise ValueError(f"Unsupported codec: {codec}")
+
+def quantize_int8(embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Quantize each vector to uint8 using its own scale (alpha) and shift (min).
+
+    A value is recovered as q * alpha + shift.
+    """
+    shifts = embeddings.min(axis=1)
+    alphas = (embeddings.max(axis=1) - shifts) / 255
+    alphas[alphas == 0] = 1.0  # constant vectors quantize to all zeros
+    quantized = np.round((embeddings - shifts[:, None]) / alphas[:, None]).astype(np.uint8)
+    return quantized, alphas.astype(np.float32), shifts.astype(np.float32)
+
+def save_vectors_to_bin(embeddings: np.ndarray, output_path: str) -> int:
+    """Save an (N, D) embedding matrix as INT8 to a little-endian binary file.
+
+    The file starts with N and D as uint32, followed by N rows of D uint8
+    values and the float32 alpha and shift of that row. Returns the number
+    of bytes written.
+    """
+    n, d = embeddings.shape
+    quantized, alphas, shifts = quantize_int8(embeddings)
+    rows = np.empty(n, dtype=np.dtype([("q", np.uint8, (d,)), ("alpha", "<f4"), ("shift", "<f4")]))
+    rows["q"] = quantized
+    rows["alpha"] = alphas
+    rows["shift"] = shifts
+    
+    with open(output_path, 'wb') as f:
+        f.write(np.array([n, d], dtype="<u4").tobytes())
+        f.write(rows.tobytes())
+    return 8 + rows.nbytes
 
-def save_embeddings_to_json(pois: List[PointOfInterest], output_path: str, compress: bool = False, decimals: int = 2) -> bool:
-    """Save POIs with embeddings to a JSON file with optional compression."""
+# NumPy name of each supported raw float dtype, recorded in the metadata JSON
+FLOAT_DTYPES = {"fp32": "float32", "fp16": "float16", "bf16": "bfloat16"}
+
+def save_vectors_raw(embeddings: np.ndarray, output_path: str, dtype: str) -> int:
+    """Save an (N, D) embedding matrix as a headerless little-endian float file.
+
+    The file can be memory-mapped directly as an (N, D) matrix of the given
+    dtype. Returns the number of bytes written.
+    """
+    if dtype == "fp32":
+        arr = embeddings.astype("<f4")
+    elif dtype == "fp16":
+        arr = embeddings.astype("<f2")
+    elif dtype == "bf16":
+        import ml_dtypes  # only needed for bfloat16 output (pip install ml_dtypes)
+        arr = embeddings.astype(ml_dtypes.bfloat16)
+    else:
+        raise ValueError(f"Unsupported dtype: {dtype}")
+    arr.tofile(output_path)
+    return arr.nbytes
+
+def save_embeddings_to_json(pois: List[PointOfInterest], output_path: str, compress: bool = False, decimals: int = 2, quant: str = "none", dtype: Optional[str] = None, codec: str = "gzip") -> Optional[List[str]]:
+    """Save POIs with embeddings to a JSON file with optional compression.
+    Returns the paths of the files written, or None if saving failed.
+
+    The JSON is column-oriented: parallel "ids", "content" and "locations"
+    lists with one entry per embedded POI, plus the "shape" of the
+    embedding matrix. By default the rounded matrix is stored inline as
+    "embeddings". With quant="int8" it is written to output_path + ".bin",
+    and with a float dtype to output_path + ".vecs" as a flat (N, D) matrix;
+    row i of either file belongs to ids[i].
+    """
     try:
-        # Optimize the data structure and quantize embeddings
-        pois_data = []
-        for poi in pois:
-            optimized_poi = {
-                "i": poi.id,  # shorter key names
-                "c": poi.content,
-                "e": optimize_embedding(poi.embedding, decimals) if poi.embedding else None
-            }
-            # Only include location if it exists
-            if poi.latitude is not None and poi.longitude is not None:
-                optimized_poi["l"] = [poi.latitude, poi.longitude]
-            pois_data.append(optimized_poi)
+        written = []
+        embedded_pois = [poi for poi in pois if poi.embedding]
+        if len(embedded_pois) < len(pois):
+            print(f"Skipping {len(pois) - len(embedded_pois)} POIs without embeddings")
+        embeddings = np.asarray([poi.embedding for poi in embedded_pois], dtype=np.float64)
+        if not embedded_pois:
+            embeddings = embeddings.reshape(0, 0)
+        
+        pois_data = {
+            "ids": [poi.id for poi in embedded_pois],
+            "content": [poi.content for poi in embedded_pois],
+            "locations": [
+                [poi.latitude, poi.longitude] if poi.latitude is not None and poi.longitude is not None else None
+                for poi in embedded_pois
+            ],
+            "shape": list(embeddings.shape),
+        }
+        
+        if quant != "none" or dtype:
+            if quant == "int8":
+                vectors_path = output_path + '.bin'
+                vectors_size = save_vectors_to_bin(embeddings, vectors_path)
+                pois_data["quant"] = quant
+            else:
+                vectors_path = output_path + '.vecs'
+                vectors_size = save_vectors_raw(embeddings, vectors_path, dtype)
+                pois_data["dtype"] = FLOAT_DTYPES[dtype]
+            written.append(vectors_path)
+            print(f"Successfully saved {quant if quant != 'none' else dtype} embeddings to {vectors_path}")
+            print(f"Embeddings file size: {vectors_size / 1024:.2f} KB")
+        else:
+            # Round the whole matrix at once
+            pois_data["embeddings"] = optimize_embeddings(embeddings, decimals)
 
-        # Convert to JSON
-        json_str = json.dumps(pois_data, ensure_ascii=False, separators=(',', ':'))  # Remove whitespace
+        # Convert to compact UTF-8 JSON; the embedding matrix stays a NumPy array for orjson's fast path
+        json_bytes = orjson.dumps(pois_data, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
 
         if compress:
             # Save compressed file
-            compressed_data = compress_json(json_str)
-            output_path_gz = output_path + '.gz'
-            with open(output_path_gz, 'wb') as f:
+            compressed_data = compress_json(json_bytes, codec)
+            output_path_compressed = output_path + CODEC_SUFFIXES[codec]
+            with open(output_path_compressed, 'wb') as f:
                 f.write(compressed_data)
-            print(f"Successfully saved compressed embeddings to {output_path_gz}")
+            written.append(output_path_compressed)
+            print(f"Successfully saved compressed embeddings to {output_path_compressed}")
             print(f"Compressed file size: {len(compressed_data) / 1024:.2f} KB")
         else:
             # Save uncompressed file
-            with open(output_path, 'w', encoding='utf-8') as f:
-                f.write(json_str)
+            with open(output_path, 'wb') as f:
+                f.write(json_bytes)
+            written.append(output_path)
             print(f"Successfully saved embeddings to {output_path}")
-            print(f"File size: {len(json_str) / 1024:.2f} KB")
+            print(f"File size: {len(json_bytes) / 1024:.2f} KB")
         
-        return True
+        return written
     except Exception as e:
         print(f"Error saving embeddings: {e}")
-        return False
+        return None
 
 def main():
-    # parser = argparse.ArgumentParser(description="Generate embeddings for POI data")
+    parser = argparse.ArgumentParser(description="Generate embeddings for POI data")
     # parser.add_argument("--poi-dir", help="Directory containing POI text files", default=CONFIG["poi_dir"])
     # parser.add_argument("--output", help="Output JSON file", default=CONFIG["output_file"])
-    # args = parser.parse_args()
+    parser.add_argument("--batch", action="store_true", help="Submit all POIs as one OpenAI batch job and wait for it")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the on-disk embedding cache")
+    parser.add_argument("--quant", choices=["none", "int8"], default="none",
+                        help="Store embeddings INT8-quantized in a binary sidecar file instead of the JSON")
+    parser.add_argument("--dtype", choices=sorted(FLOAT_DTYPES),
+                        help="Store embeddings as a raw float matrix of this dtype in a sidecar file instead of the JSON")
+    parser.add_argument("--codec", choices=sorted(CODEC_SUFFIXES),
+                        help="Compress the JSON output with this codec")
+    args = parser.parse_args()
+    if args.quant != "none" and args.dtype:
+        parser.error("--quant and --dtype are mutually exclusive")
     poi_dir = "/Users/xiao/workspace/tourGuideAi/tourGuideAi/POIData/data/"
     output_file_path = "/Users/xiao/workspace/tourGuideAi/tourGuideAi/POIData/output/nyc_batch_019_embeddings.json"
 
@@ -238,18 +497,34 @@ def main():
     
     # Generate embeddings
     print("Generating embeddings (this may take a while)...")
-    processed_pois = generate_embeddings_for_pois(all_pois)
+    if args.batch:
+        processed_pois = generate_embeddings_batch_api(all_pois)
+    else:
+        processed_pois = asyncio.run(generate_embeddings_for_pois(all_pois, use_cache=not args.no_cache))
     
-    # Save embeddings to JSON (both compressed and uncompressed versions)
-    success = save_embeddings_to_json(processed_pois, output_file_path, compress=False, decimals=8)
+    # Save embeddings to JSON, compressed only when a codec is given
+    written = save_embeddings_to_json(processed_pois, output_file_path, compress=args.codec is not None, decimals=8,
+                                     quant=args.quant, dtype=args.dtype, codec=args.codec or "gzip")
     
-    if success:
+    if written:
+        json_path = written[-1]
         print("\n=== Embedding Generation Complete ===")
         print(f"Generated embeddings for {len(processed_pois)} POIs")
         print("\nNext Steps:")
-        print("1. Copy the .gz file to your iOS app's Documents directory")
-        print("2. In your app, decompress the file before use")
-        print("3. Update your app's loading code to handle the optimized format")
+        print(f"1. Copy {', '.join(written)} to your iOS app's Documents directory")
+        if args.codec:
+            print(f"2. In your app, decompress {os.path.basename(json_path)} ({args.codec}) before use")
+        else:
+            print(f"2. {os.path.basename(json_path)} is plain JSON and needs no decompression")
+        print('3. Load the column-oriented JSON: "ids", "content" and "locations" are parallel lists '
+              'with one entry per POI, and "shape" is the (N, D) size of the embedding matrix')
+        if args.quant == "int8":
+            print(f"4. Row i of {os.path.basename(written[0])} (after the N, D header) is the embedding of ids[i] "
+                  "as uint8 codes q plus its alpha and shift; recover it as q * alpha + shift")
+        elif args.dtype:
+            print(f"4. Read row i of {os.path.basename(written[0])} ({FLOAT_DTYPES[args.dtype]}) as the embedding of ids[i]")
+        else:
+            print('4. Row i of the "embeddings" matrix is the embedding of ids[i]')
     else:
         print("Embedding generation failed")
 
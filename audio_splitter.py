@@ -43,7 +43,28 @@ def split_audio(input_file, chunk_duration_minutes=25, overlap_seconds=1):
     output_dir = "/Users/xiao/Documents/mjtt_audio/split_audio"
     os.makedirs(output_dir, exist_ok=True)
     
-    # Split the audio into chunks
+    base_name = os.path.splitext(os.path.basename(input_file))[0]
+    
+    # Without overlap, the segment muxer writes every chunk in a single pass
+    if overlap_seconds == 0:
+        cmd = [
+            'ffmpeg',
+            '-i', input_file,
+            '-f', 'segment',
+            '-segment_time', str(chunk_duration),
+            '-segment_start_number', '1',  # Number parts from 1 like the overlapping path
+            '-reset_timestamps', '1',
+            '-c', 'copy',  # Copy the codec to avoid re-encoding
+            '-y',  # Overwrite output files if they exist
+            os.path.join(output_dir, f"{base_name}_part%d.m4a")
+        ]
+        
+        print(f"Splitting into {total_chunks} chunks of {timedelta(seconds=chunk_duration)} in one pass")
+        subprocess.run(cmd, check=True)
+        print("Completed all chunks")
+        return
+    
+    # Split the audio into overlapping chunks
     for i in range(total_chunks):
         start_time = i * chunk_duration
         duration = chunk_duration + overlap_seconds
@@ -51,14 +72,14 @@ def split_audio(input_file, chunk_duration_minutes=25, overlap_seconds=1):
         # Generate output filename
         output_filename = os.path.join(
             output_dir,
-            f"{os.path.splitext(os.path.basename(input_file))[0]}_part{i+1}.m4a"
+            f"{base_name}_part{i+1}.m4a"
         )
         
         # Use ffmpeg to split the audio
         cmd = [
             'ffmpeg',
+            '-ss', str(start_time),  # Seek on the input so ffmpeg uses the container index
             '-i', input_file,
-            '-ss', str(start_time),
             '-t', str(duration),
             '-c', 'copy',  # Copy the codec to avoid re-encoding
             '-y',  # Overwrite output files if they exist
@@ -1,5 +1,14 @@
 import os
+import asyncio
+import base64
+import json
+import random
+import tempfile
+import time
 import google.generativeai as genai
+from google import genai as genai_client
+from google.genai import types
+from google.api_core.exceptions import ResourceExhausted
 from pathlib import Path
 import mimetypes
 import argparse
@@ -12,41 +21,18 @@ step2
 
 load_dotenv()
 
-def setup_gemini(api_key):
-    """Set up the Gemini API with the provided API key."""
-    genai.configure(api_key=api_key)
+# Maximum attempts per file when the API reports it is out of quota
+MAX_RETRIES = 5
 
-def transcribe_audio(audio_path, output_path):
-    """
-    Transcribe an audio file using Gemini API and save the transcription.
-    
-    Args:
-        audio_path (str): Path to the audio file
-        output_path (str): Full path where to save the transcription
-    """
-    # Create output directory if it doesn't exist
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    
-    # Initialize the model
-    model = genai.GenerativeModel('gemini-2.0-flash')
-    
-    # Get the MIME type of the audio file
-    mime_type = mimetypes.guess_type(audio_path)[0]
-    if not mime_type or not mime_type.startswith('audio/'):
-        mime_type = 'audio/mpeg'  # default to mp3 if can't determine
-    
-    # Read the audio file
-    with open(audio_path, 'rb') as audio_file:
-        audio_data = audio_file.read()
-    
-    # Create the audio blob
-    audio_blob = {
-        "mime_type": mime_type,
-        "data": audio_data
-    }
-    
-    # Create the prompt for transcription
-    prompt = """You are a professional audio transcription expert specializing in Mandarin Chinese tour guide content. Your task is to transcribe the provided audio with high accuracy and natural language flow.
+# Audio files larger than this are uploaded via the Files API for batch jobs
+# instead of being inlined in the batch request
+INLINE_AUDIO_LIMIT = 20 * 1024 * 1024
+
+# Seconds between batch job status checks
+BATCH_POLL_INTERVAL = 30
+
+# Prompt used for transcription
+TRANSCRIPTION_PROMPT = """You are a professional audio transcription expert specializing in Mandarin Chinese tour guide content. Your task is to transcribe the provided audio with high accuracy and natural language flow.
 
 Key Requirements:
 1. Content Organization:
@@ -74,9 +60,49 @@ Key Requirements:
    - Format text for easy reading and comprehension
 
 Please transcribe the audio following these guidelines while maintaining the authenticity and professionalism of the tour guide's delivery."""
+
+def setup_gemini(api_key):
+    """Set up the Gemini API with the provided API key."""
+    genai.configure(api_key=api_key)
+
+def guess_audio_mime_type(audio_path):
+    """Get the MIME type of an audio file."""
+    mime_type = mimetypes.guess_type(audio_path)[0]
+    if not mime_type or not mime_type.startswith('audio/'):
+        mime_type = 'audio/mpeg'  # default to mp3 if can't determine
+    return mime_type
+
+def upload_audio(audio_path):
+    """Upload an audio file via the Gemini Files API and wait until it is ready to use."""
+    uploaded = genai.upload_file(audio_path, mime_type=guess_audio_mime_type(audio_path))
+    while uploaded.state.name == "PROCESSING":
+        time.sleep(1)
+        uploaded = genai.get_file(uploaded.name)
+    if uploaded.state.name != "ACTIVE":
+        genai.delete_file(uploaded.name)
+        raise RuntimeError(f"Upload of {audio_path} failed with state {uploaded.state.name}")
+    return uploaded
+
+def transcribe_audio(audio_path, output_path):
+    """
+    Transcribe an audio file using Gemini API and save the transcription.
     
-    # Generate the transcription
-    response = model.generate_content([prompt, audio_blob])
+    Args:
+        audio_path (str): Path to the audio file
+        output_path (str): Full path where to save the transcription
+    """
+    # Create output directory if it doesn't exist
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    
+    # Initialize the model
+    model = genai.GenerativeModel('gemini-2.0-flash')
+    
+    # Upload the audio and generate the transcription
+    uploaded = upload_audio(audio_path)
+    try:
+        response = model.generate_content([TRANSCRIPTION_PROMPT, uploaded])
+    finally:
+        genai.delete_file(uploaded.name)
     
     # Save the transcription
     with open(output_path, 'w', encoding='utf-8') as f:
@@ -85,13 +111,51 @@ Please transcribe the audio following these guidelines while maintaining the aut
     print(f"Transcription saved to: {output_path}")
     return output_path
 
-def process_directory(input_dir, output_dir):
+async def transcribe_audio_async(model, audio_path, output_path, semaphore):
     """
-    Process all audio files in a directory and transcribe them.
+    Transcribe an audio file asynchronously and save the transcription.
+    Retries with exponential backoff when the API reports it is out of quota.
+    
+    Args:
+        model: Gemini model used for transcription
+        audio_path (str): Path to the audio file
+        output_path (str): Full path where to save the transcription
+        semaphore (asyncio.Semaphore): Limits the number of concurrent requests
+    """
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    
+    async with semaphore:
+        print(f"\nProcessing: {audio_path}")
+        uploaded = await asyncio.to_thread(upload_audio, audio_path)
+        try:
+            for attempt in range(MAX_RETRIES):
+                try:
+                    response = await model.generate_content_async([TRANSCRIPTION_PROMPT, uploaded])
+                    break
+                except ResourceExhausted:
+                    if attempt == MAX_RETRIES - 1:
+                        raise
+                    delay = 2 ** attempt + random.random()
+                    print(f"Rate limited on {audio_path}, retrying in {delay:.1f}s...")
+                    await asyncio.sleep(delay)
+        finally:
+            await asyncio.to_thread(genai.delete_file, uploaded.name)
+    
+    with open(output_path, 'w', encoding='utf-8') as f:
+        f.write(response.text)
+    
+    print(f"Transcription saved to: {output_path}")
+    return output_path
+
+def process_directory(input_dir, output_dir, concurrency=8, use_batch=False):
+    """
+    Process all audio files in a directory and transcribe them concurrently.
     
     Args:
         input_dir (str): Directory containing audio files
         output_dir (str): Directory to save transcriptions
+        concurrency (int): Maximum number of files transcribed at the same time
+        use_batch (bool): Submit all files as one Gemini Batch API job instead
     """
     # Supported audio formats
     audio_extensions = {'.mp3', '.wav', '.m4a', '.ogg', '.flac'}
@@ -108,18 +172,122 @@ def process_directory(input_dir, output_dir):
         return
     
     print(f"Found {len(audio_files)} audio files to process")
+    if use_batch:
+        transcribe_files_batch(audio_files, output_dir)
+    else:
+        asyncio.run(_process_files_async(audio_files, output_dir, concurrency))
+
+async def _process_files_async(audio_files, output_dir, concurrency):
+    """Transcribe the given audio files with at most `concurrency` requests in flight."""
+    model = genai.GenerativeModel('gemini-2.0-flash')
+    semaphore = asyncio.Semaphore(concurrency)
     
-    # Process each audio file
+    tasks = []
     for audio_path in audio_files:
-        try:
-            print(f"\nProcessing: {audio_path}")
-            # Construct output path for batch processing
-            audio_filename = Path(audio_path).stem
-            output_path = os.path.join(output_dir, f"{audio_filename}_transcription.txt")
-            transcribe_audio(audio_path, output_path)
-        except Exception as e:
-            print(f"Error processing {audio_path}: {str(e)}")
-            continue
+        # Construct output path for batch processing
+        audio_filename = Path(audio_path).stem
+        output_path = os.path.join(output_dir, f"{audio_filename}_transcription.txt")
+        tasks.append(transcribe_audio_async(model, audio_path, output_path, semaphore))
+    
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    for audio_path, result in zip(audio_files, results):
+        if isinstance(result, Exception):
+            print(f"Error processing {audio_path}: {str(result)}")
+
+def wait_until_active(client, audio_file):
+    """Wait until a file uploaded with the google-genai client is ready to use."""
+    while audio_file.state.name == "PROCESSING":
+        time.sleep(1)
+        audio_file = client.files.get(name=audio_file.name)
+    if audio_file.state.name != "ACTIVE":
+        raise RuntimeError(f"Upload of {audio_file.display_name or audio_file.name} failed with state {audio_file.state.name}")
+
+def transcribe_files_batch(audio_files, output_dir):
+    """
+    Transcribe audio files with the Gemini Batch API and save each transcription.
+    Files above INLINE_AUDIO_LIMIT are uploaded first and the rest are inlined
+    in the job's requests. Blocks until the job has finished.
+    
+    Args:
+        audio_files (list): Paths of the audio files to transcribe
+        output_dir (str): Directory to save transcriptions
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    client = genai_client.Client()
+    uploaded_files = []
+    
+    batch_input = tempfile.NamedTemporaryFile('w', suffix='.jsonl', encoding='utf-8', delete=False)
+    try:
+        # Write one request per file, keyed by the file stem
+        with batch_input:
+            for audio_path in audio_files:
+                mime_type = guess_audio_mime_type(audio_path)
+                if os.path.getsize(audio_path) > INLINE_AUDIO_LIMIT:
+                    audio_file = client.files.upload(file=audio_path, config=types.UploadFileConfig(mime_type=mime_type))
+                    uploaded_files.append(audio_file)
+                    audio_part = {"file_data": {"file_uri": audio_file.uri, "mime_type": mime_type}}
+                else:
+                    with open(audio_path, 'rb') as f:
+                        audio_part = {"inline_data": {"mime_type": mime_type, "data": base64.b64encode(f.read()).decode('ascii')}}
+                request = {
+                    "key": Path(audio_path).stem,
+                    "request": {"contents": [{"parts": [{"text": TRANSCRIPTION_PROMPT}, audio_part]}]}
+                }
+                batch_input.write(json.dumps(request) + '\n')
+        
+        # Uploaded files can only be referenced once they are processed
+        for audio_file in uploaded_files:
+            wait_until_active(client, audio_file)
+        
+        input_file = client.files.upload(
+            file=batch_input.name,
+            config=types.UploadFileConfig(display_name='audio-transcription-requests', mime_type='jsonl')
+        )
+        job = client.batches.create(
+            model='gemini-2.0-flash',
+            src=input_file.name,
+            config={'display_name': 'audio-transcription'}
+        )
+        print(f"Submitted batch job {job.name} with {len(audio_files)} files")
+        
+        # Wait for the job to finish
+        finished_states = {'JOB_STATE_SUCCEEDED', 'JOB_STATE_FAILED', 'JOB_STATE_CANCELLED', 'JOB_STATE_EXPIRED'}
+        while job.state.name not in finished_states:
+            time.sleep(BATCH_POLL_INTERVAL)
+            job = client.batches.get(name=job.name)
+            print(f"Batch job {job.name} state: {job.state.name}")
+        
+        if job.state.name != 'JOB_STATE_SUCCEEDED':
+            print(f"Error: batch job {job.name} finished with state {job.state.name}")
+            return
+        
+        # Save each returned transcription
+        output = client.files.download(file=job.dest.file_name).decode('utf-8')
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            key = result.get("key")
+            response = result.get("response")
+            if not response or "candidates" not in response:
+                print(f"Error processing {key}: {result.get('error', result)}")
+                continue
+            text = ''.join(part.get("text", "") for part in response["candidates"][0]["content"]["parts"])
+            output_path = os.path.join(output_dir, f"{key}_transcription.txt")
+            with open(output_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            print(f"Transcription saved to: {output_path}")
+    finally:
+        os.remove(batch_input.name)
+        for audio_file in uploaded_files:
+            client.files.delete(name=audio_file.name)
+
+def positive_int(value):
+    """argparse type for options that must be a positive integer."""
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {value}")
+    return number
 
 def main():
     # Set up argument parser
@@ -127,6 +295,10 @@ def main():
     parser.add_argument('input_path', help='Path to audio file or directory')
     parser.add_argument('-o', '--output', required=True,
                       help='For single file: full output file path (e.g., /path/to/output.txt). For directory: output directory path')
+    parser.add_argument('-c', '--concurrency', type=positive_int, default=8,
+                      help='For directory: maximum number of files transcribed at the same time')
+    parser.add_argument('--batch', action='store_true',
+                      help='For directory: transcribe all files in one Gemini batch job and poll until it finishes')
     args = parser.parse_args()
     
     api_key = os.getenv('GOOGLE_API_KEY')
@@ -144,7 +316,7 @@ def main():
     try:
         if os.path.isdir(args.input_path):
             # Process directory
-            process_directory(args.input_path, args.output)
+            process_directory(args.input_path, args.output, args.concurrency, args.batch)
         else:
             # Process single file with exact output path
             output_path = transcribe_audio(args.input_path, args.output)
@@ -1,65 +1,57 @@
 import os
-import glob
-import re
 """
-step5: combine all the batch files into a single file
+step5: copy the translated sections into the final file
+
+translate_text.py (step4) now appends every batch, in order, to a single
+nyc_translated.txt instead of writing one nyc_batch_NNN.txt per batch, so
+there are no batch files left to combine. This step reads that file and
+writes its non-empty sections to the final output.
 """
-# Directory with the batch files
-input_dir = "/Users/xiao/Documents/mjtt_audio/transcribe_version3/nyc_combined_english_txt"
-batch_pattern = "*_batch_*.txt"
+# Translated file written by step4
+input_file = "/Users/xiao/Documents/mjtt_audio/transcribe_version3/nyc_combined_english_txt/nyc_translated.txt"
 
 # Output file
 output_file = "/Users/xiao/Documents/mjtt_audio/transcribe_version3/nyc_combined_english_final.txt"
 
-def get_batch_number(filename):
-    """Extract the batch number from the filename."""
-    # Match any pattern ending with _batch_XXX.txt where XXX is a number
-    match = re.search(r'_batch_(\d+)\.txt$', filename)
-    if match:
-        return int(match.group(1))
-    return 0
+# Buffer size for writing the combined output
+WRITE_BUFFER_SIZE = 1 << 20
+
+def iter_sections(file_path):
+    """
+    Yield the sections of the translated file, separated by lines holding
+    only '---'. The file is read line by line, so only one section is held
+    in memory at a time.
+    """
+    lines = []
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line == '---\n' and lines:
+                # The newline before the separator belongs to the separator
+                yield ''.join(lines).removesuffix('\n')
+                lines = []
+            else:
+                lines.append(line)
+    yield ''.join(lines)
 
 def combine_batches():
-    """Combine all batch files into a single file."""
-    # Get all batch files
-    batch_files = glob.glob(os.path.join(input_dir, batch_pattern))
-    
-    if not batch_files:
-        print(f"No batch files found matching pattern '{batch_pattern}' in '{input_dir}'")
+    """Write the non-empty sections of the translated file to the final file."""
+    if not os.path.exists(input_file):
+        print(f"Translated file '{input_file}' not found, run translate_text.py first")
         return
     
-    # Sort the files by batch number to maintain original order
-    batch_files.sort(key=get_batch_number)
-    
-    print(f"Found {len(batch_files)} batch files to combine.")
-    print("Files will be processed in this order:")
-    for i, file in enumerate(batch_files):
-        print(f"  {i+1}. {os.path.basename(file)} (batch #{get_batch_number(file)})")
-    
-    # Initialize the combined content
-    combined_content = []
     total_sections = 0
     
-    # Process each batch file
-    for batch_file in batch_files:
-        with open(batch_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        # Split the content into sections
-        sections = content.split('\n---\n')
-        sections = [section for section in sections if section.strip()]
-        
-        # Add to the combined content
-        combined_content.extend(sections)
-        total_sections += len(sections)
-        
-        print(f"Processed {os.path.basename(batch_file)}: {len(sections)} sections")
-    
-    # Write the combined content to the output file
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write('\n---\n'.join(combined_content))
+    # Stream the sections straight into the output file
+    with open(output_file, 'w', encoding='utf-8', buffering=WRITE_BUFFER_SIZE) as out:
+        for section in iter_sections(input_file):
+            if not section.strip():
+                continue
+            if total_sections:
+                out.write('\n---\n')
+            out.write(section)
+            total_sections += 1
     
-    print(f"Combination complete! Combined {total_sections} sections into: {output_file}")
+    print(f"Combination complete! Wrote {total_sections} sections into: {output_file}")
 
 if __name__ == "__main__":
-    combine_batches() 
\ No newline at end of file
+    combine_batches()
\ No newline at end of file
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import os
+import re
 import argparse
 from pathlib import Path
 import logging
@@ -12,6 +13,21 @@ input_dir = "/Users/xiao/Documents/mjtt_audio/transcribe_version3/nyc_by_audio_t
 combined_file = "/Users/xiao/Documents/mjtt_audio/transcribe_version3/nyc_combined_txt/nyc_combined_text.txt"
 processed_file = "/Users/xiao/Documents/mjtt_audio/transcribe_version3/nyc_combined_txt/nyc_processed_text.txt"
 
+# Deletes every character str.split() treats as whitespace, including the full-width space
+_WS_TABLE = str.maketrans('', '', ' \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f\x85\xa0\u1680'
+                                  '\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007\u2008\u2009\u200a'
+                                  '\u2028\u2029\u202f\u205f\u3000')
+
+# Extract the part number from filename like 'ny_11hr_audio_part28_transcription.txt'
+_PART_RE = re.compile(r'part(\d+)_transcription')
+
+# Buffer size for writing the combined and processed output
+WRITE_BUFFER_SIZE = 1 << 20
+
+# Parts containing any of these phrases are dropped
+BLOCKLIST = ("美景听听", "美景聽聽")
+_BLOCKLIST_RE = re.compile('|'.join(map(re.escape, BLOCKLIST)))
+
 def setup_logging():
     """Set up logging configuration."""
     logging.basicConfig(
@@ -19,6 +35,50 @@ def setup_logging():
         format='%(asctime)s - %(levelname)s - %(message)s'
     )
 
+def list_txt_files(input_dir):
+    """
+    Get all .txt files in the input directory, sorted by part number.
+    
+    Args:
+        input_dir (str): Path to the directory containing text files
+    """
+    # Convert input directory to Path object
+    input_path = Path(input_dir)
+    
+    # Check if input directory exists
+    if not input_path.exists():
+        raise FileNotFoundError(f"Input directory '{input_dir}' does not exist")
+    
+    # Get all .txt files in the directory
+    txt_files = list(input_path.glob('*.txt'))
+    
+    # Sort files by part number, decorating each file with its number once;
+    # files without a part number go at the end
+    keyed = [(int(m.group(1)) if (m := _PART_RE.search(p.name)) else 1 << 30, p) for p in txt_files]
+    keyed.sort()
+    return [p for _, p in keyed]
+
+def read_txt_files(txt_files, intermediate=None):
+    """
+    Yield the content of each text file followed by a newline, exactly as
+    combine_txt_files writes it to the combined file.
+    
+    Args:
+        txt_files (list): Paths of the text files, in order
+        intermediate (file, optional): If given, the content is also written to it
+    """
+    for txt_file in txt_files:
+        logging.info(f"Processing {txt_file.name}")
+        try:
+            with open(txt_file, 'r', encoding='utf-8') as infile:
+                content = infile.read() + '\n'
+        except Exception as e:
+            logging.error(f"Error processing {txt_file.name}: {str(e)}")
+            continue
+        if intermediate is not None:
+            intermediate.write(content)
+        yield content
+
 def combine_txt_files(input_dir, output_file):
     """
     Combine all .txt files in the input directory into a single output file.
@@ -28,28 +88,7 @@ def combine_txt_files(input_dir, output_file):
         output_file (str): Path to the output file
     """
     try:
-        # Convert input directory to Path object
-        input_path = Path(input_dir)
-        
-        # Check if input directory exists
-        if not input_path.exists():
-            raise FileNotFoundError(f"Input directory '{input_dir}' does not exist")
-        
-        # Get all .txt files in the directory
-        txt_files = list(input_path.glob('*.txt'))
-        
-        # Sort files by part number
-        def get_part_number(filename):
-            # Extract the part number from filename like 'ny_11hr_audio_part28_transcription.txt'
-            try:
-                # Find the part number after 'part' and before '_transcription'
-                part_str = filename.name.split('part')[1].split('_transcription')[0]
-                return int(part_str)
-            except (IndexError, ValueError):
-                # If we can't parse the part number, put it at the end
-                return float('inf')
-        
-        txt_files = sorted(txt_files, key=get_part_number)
+        txt_files = list_txt_files(input_dir)
         
         if not txt_files:
             logging.warning(f"No .txt files found in '{input_dir}'")
@@ -61,21 +100,9 @@ def combine_txt_files(input_dir, output_file):
             logging.info(f"- {file.name}")
         
         # Combine all files
-        with open(output_file, 'w', encoding='utf-8') as outfile:
-            for txt_file in txt_files:
-                logging.info(f"Processing {txt_file.name}")
-                try:
-                    with open(txt_file, 'r', encoding='utf-8') as infile:
-                        # Add a header with the source filename
-                        # outfile.write(f"\n{'='*50}\n")
-                        # outfile.write(f"Content from: {txt_file.name}\n")
-                        # outfile.write(f"{'='*50}\n\n")
-                        
-                        # Copy the content
-                        outfile.write(infile.read())
-                        outfile.write('\n')
-                except Exception as e:
-                    logging.error(f"Error processing {txt_file.name}: {str(e)}")
+        with open(output_file, 'w', encoding='utf-8', buffering=WRITE_BUFFER_SIZE) as outfile:
+            for _ in read_txt_files(txt_files, intermediate=outfile):
+                pass
         
         logging.info(f"Successfully combined files into '{output_file}'")
         
@@ -83,6 +110,67 @@ def combine_txt_files(input_dir, output_file):
         logging.error(f"An error occurred: {str(e)}")
         raise
 
+def split_by_hashtags(chunks):
+    """
+    Split consecutive chunks of text by hashtags (#), yielding the same
+    fragments as splitting their concatenation.
+    """
+    carry = ''
+    for chunk in chunks:
+        fragments = chunk.split('#')
+        fragments[0] = carry + fragments[0]
+        # The last fragment may continue in the next chunk
+        carry = fragments.pop()
+        yield from fragments
+    yield carry
+
+def pair_titles(fragments):
+    """
+    Handle the "#title#content" format: a short fragment followed by another
+    fragment is treated as a title and combined with it as "title:content".
+    Empty fragments are skipped.
+    """
+    fragments = iter(fragments)
+    for fragment in fragments:
+        part = fragment.strip()
+        # Skip empty parts
+        if not part:
+            continue
+        
+        # If this part looks like a title (short) and next part exists
+        if len(part) < 50:  # reasonable title length
+            next_fragment = next(fragments, None)
+            if next_fragment is not None:
+                # Combine title and content
+                yield part + ':' + next_fragment.strip()
+                continue
+        
+        # Regular part, just add it
+        yield part
+
+def write_processed_parts(parts, output_file):
+    """
+    Remove all blank spaces and newlines from each part, filter out parts
+    containing "美景听听", and write them to the output file separated by '---'.
+    Returns the number of parts written.
+    
+    Args:
+        parts (iterable): Parts to process
+        output_file (str): Path to the output processed file
+    """
+    count = 0
+    with open(output_file, 'w', encoding='utf-8', buffering=WRITE_BUFFER_SIZE) as outfile:
+        for part in parts:
+            # Remove all whitespace and newlines
+            cleaned_part = part.translate(_WS_TABLE)
+            # Only add non-empty parts that don't contain "美景听听"
+            if cleaned_part and not _BLOCKLIST_RE.search(cleaned_part):
+                if count:
+                    outfile.write('\n---\n')
+                outfile.write(cleaned_part)
+                count += 1
+    return count
+
 def process_combined_text(input_file, output_file):
     """
     Process the combined text file by:
@@ -100,59 +188,65 @@ def process_combined_text(input_file, output_file):
         with open(input_file, 'r', encoding='utf-8') as infile:
             content = infile.read()
         
-        # First split by hashtags
-        raw_parts = content.split('#')
+        total_parts = write_processed_parts(pair_titles(split_by_hashtags([content])), output_file)
         
-        # Process parts to handle "#title#content" format
-        parts = []
-        i = 0
-        while i < len(raw_parts):
-            # Skip empty parts
-            if not raw_parts[i].strip():
-                i += 1
-                continue
-                
-            # If this part looks like a title (short, no spaces) and next part exists
-            if (i + 1 < len(raw_parts) and 
-                len(raw_parts[i].strip()) < 50):  # reasonable title length
-                # Combine title and content
-                combined = raw_parts[i].strip() + ':' + raw_parts[i + 1].strip()
-                parts.append(combined)
-                i += 2
-            else:
-                # Regular part, just add it
-                parts.append(raw_parts[i].strip())
-                i += 1
+        logging.info(f"Successfully processed text into '{output_file}'")
+        logging.info(f"Total parts processed: {total_parts}")
         
-        # Process each part: remove blanks and newlines, filter out unwanted content
-        processed_parts = []
-        for part in parts:
-            # Remove all whitespace and newlines
-            cleaned_part = ''.join(part.split())
-            # Only add non-empty parts that don't contain "美景听听"
-            if cleaned_part and "美景听听" not in cleaned_part and "美景聽聽" not in cleaned_part:
-                processed_parts.append(cleaned_part)
+    except Exception as e:
+        logging.error(f"An error occurred during text processing: {str(e)}")
+        raise
+
+def process_txt_files(input_dir, output_file, combined_file=None):
+    """
+    Combine and process all .txt files in the input directory in a single
+    streaming pass, with the same result as combine_txt_files followed by
+    process_combined_text.
+    
+    Args:
+        input_dir (str): Path to the directory containing text files
+        output_file (str): Path to the output processed file
+        combined_file (str, optional): If given, also write the combined text here
+    """
+    try:
+        txt_files = list_txt_files(input_dir)
         
-        # Write the processed content
-        with open(output_file, 'w', encoding='utf-8') as outfile:
-            outfile.write('\n---\n'.join(processed_parts))
+        if not txt_files:
+            logging.warning(f"No .txt files found in '{input_dir}'")
+            return
+        
+        logging.info(f"Found {len(txt_files)} text files to process")
+        logging.info("Files will be processed in the following order:")
+        for file in txt_files:
+            logging.info(f"- {file.name}")
         
+        intermediate = open(combined_file, 'w', encoding='utf-8', buffering=WRITE_BUFFER_SIZE) if combined_file else None
+        try:
+            chunks = read_txt_files(txt_files, intermediate=intermediate)
+            total_parts = write_processed_parts(pair_titles(split_by_hashtags(chunks)), output_file)
+        finally:
+            if intermediate is not None:
+                intermediate.close()
+        
+        if combined_file:
+            logging.info(f"Successfully combined files into '{combined_file}'")
         logging.info(f"Successfully processed text into '{output_file}'")
-        logging.info(f"Total parts processed: {len(processed_parts)}")
+        logging.info(f"Total parts processed: {total_parts}")
         
     except Exception as e:
-        logging.error(f"An error occurred during text processing: {str(e)}")
+        logging.error(f"An error occurred: {str(e)}")
         raise
 
 def main():
+    parser = argparse.ArgumentParser(description='Combine and process transcription text files')
+    parser.add_argument('--keep-intermediate', action='store_true',
+                        help=f"Also write the combined text to '{combined_file}'")
+    args = parser.parse_args()
     
     setup_logging()
     
-    # First combine the files
-    combine_txt_files(input_dir, combined_file)
-    
-    # Then process the combined text
-    process_combined_text(combined_file, processed_file)
+    # Combine and process the files in one pass
+    process_txt_files(input_dir, processed_file, combined_file if args.keep_intermediate else None)
 
 if __name__ == '__main__':
-    main() 
\ No newline at end of file
+    main()
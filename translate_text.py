@@ -1,134 +1,463 @@
 import os
-import google.generativeai as genai
-from typing import List, Tuple
+import argparse
+import asyncio
+import hashlib
+import logging
+import logging.handlers
+import mmap
+import random
+import re
+import shelve
 import time
+import aiofiles
+import google.generativeai as genai
+from google.api_core.exceptions import DeadlineExceeded, InternalServerError, ResourceExhausted, ServiceUnavailable
+from typing import Awaitable, Callable, Dict, Iterable, Iterator, List, Tuple
 from dotenv import load_dotenv
 
+try:
+    import uvloop  # optional faster event loop (0.18+ for uvloop.run), not available on Windows
+except ImportError:
+    uvloop = None
+
 """
 step4
 """
 # Load environment variables from .env file
 load_dotenv()
 
-# Input and output file paths
-input_file = "/Users/xiao/Documents/mjtt_audio/transcribe_version3/nyc_combined_txt/nyc_processed_text.txt"
-  
-# Base output directory and filename
-output_dir = "/Users/xiao/Documents/mjtt_audio/transcribe_version3/nyc_combined_english_txt"
-output_base = "nyc_batch"
+logger = logging.getLogger(__name__)
+
+# Output filename, written to the directory given by --output-dir
+output_name = "nyc_translated.txt"
+
+# On-disk cache of translations from earlier runs
+cache_file = "translate_cache.db"
+
+# Translation prompt, split around the text to translate
+_PROMPT_PREFIX = """You are a professional translator.
+
+TASK: Translate the Chinese text to English. This is VERY IMPORTANT.
+
+The text contains multiple sections separated by [SECTION_BREAK].
+
+Specific Translation Requirements:
+1. TRANSLATE FROM CHINESE TO ENGLISH. Do not keep any Chinese characters in your response.
+2. Translate EVERY SINGLE WORD from Chinese to English.
+3. Maintain all [SECTION_BREAK] separators exactly as they appear.
+4. Do not add or remove any section breaks.
+5. If you see Chinese text, you MUST translate it to English.
+
+TEXT TO TRANSLATE (CHINESE → ENGLISH):
+"""
+_PROMPT_SUFFIX = """
+
+IMPORTANT: Your response must be ENTIRELY in English.
+"""
+
+# Stricter prompt for retranslating a single section whose translation came back split
+_SINGLE_PROMPT_PREFIX = """You are a professional translator.
 
-def read_text_file(file_path: str) -> str:
-    """Read the content of the text file."""
-    with open(file_path, 'r', encoding='utf-8') as f:
-        return f.read()
+TASK: Translate the Chinese text to English. This is VERY IMPORTANT.
+
+Specific Translation Requirements:
+1. TRANSLATE FROM CHINESE TO ENGLISH. Do not keep any Chinese characters in your response.
+2. Translate EVERY SINGLE WORD from Chinese to English.
+3. Output EXACTLY one translation, with no section markers such as [SECTION_BREAK].
+
+TEXT TO TRANSLATE (CHINESE → ENGLISH):
+"""
 
-def split_into_sections(content: str) -> List[str]:
-    """Split the content into sections based on '---' delimiter."""
-    return [section.strip() for section in content.split('---') if section.strip()]
+# Separator between sections, chosen to be unlikely to appear in the text
+_SPLIT_SEP = "[SECTION_BREAK]"
+_JOIN_SEP = "\n" + _SPLIT_SEP + "\n"
+
+# Splits a translation on the section separators, dropping surrounding whitespace
+_SEP_RE = re.compile(r'\s*' + re.escape(_SPLIT_SEP) + r'\s*')
+
+# Defaults for the command line options
+DEFAULT_MODEL = "gemini-2.0-flash"
+DEFAULT_CONCURRENCY = 20
+DEFAULT_QPM = 500
+
+# Limits the number of translation requests in flight, set from --concurrency in main()
+SEM = asyncio.Semaphore(DEFAULT_CONCURRENCY)
+
+# Maximum attempts per request on transient API errors
+MAX_RETRIES = 5
+
+# Errors worth retrying: rate limiting (429), server errors (500, 503) and timeouts
+TRANSIENT_ERRORS = (ResourceExhausted, InternalServerError, ServiceUnavailable, DeadlineExceeded, asyncio.TimeoutError)
+
+def setup_logging():
+    """
+    Set up logging configuration.
+    Records are buffered and written to stderr in bursts: when 100 are
+    buffered, right away for errors, or when flush_logs() is called, rather
+    than with one write per message.
+    """
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    logging.basicConfig(
+        level=logging.INFO,
+        handlers=[logging.handlers.MemoryHandler(capacity=100, target=handler)]
+    )
+
+def flush_logs():
+    """Write out the log records buffered so far."""
+    for handler in logging.getLogger().handlers:
+        handler.flush()
+
+class RequestBucket:
+    """Spaces out request starts so that no more than `qpm` begin per minute."""
+    def __init__(self, qpm: int):
+        self.interval = 60 / qpm
+        self.next_slot = 0.0
+    
+    async def acquire(self) -> None:
+        now = time.monotonic()
+        wait = self.next_slot - now
+        self.next_slot = max(now, self.next_slot) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+# Keeps requests under the Gemini queries-per-minute quota, set from --qpm in main()
+BUCKET = RequestBucket(DEFAULT_QPM)
+
+def iter_sections(file_path: str) -> Iterator[str]:
+    """
+    Yield the sections of the text file, split on the '---' delimiter.
+    The file is memory-mapped and each section is decoded on its own, so the
+    whole content is never held in memory as one string.
+    """
+    if os.path.getsize(file_path) == 0:
+        return
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        while start <= len(mm):
+            end = mm.find(b'---', start)
+            if end == -1:
+                end = len(mm)
+            section = mm[start:end].decode('utf-8').strip()
+            if section:
+                yield section
+            start = end + 3
+
+async def call_with_retry(request: Callable[[], Awaitable]):
+    """
+    Make an API request, limited by SEM and BUCKET.
+    Retries transient errors with exponential backoff and jitter.
+    """
+    for attempt in range(MAX_RETRIES):
+        async with SEM:
+            await BUCKET.acquire()
+            try:
+                return await request()
+            except TRANSIENT_ERRORS as e:
+                if attempt == MAX_RETRIES - 1:
+                    raise
+                error = e
+        delay = 2 ** attempt + random.random()
+        logger.warning("Request failed (%s), retrying in %.1f seconds...", error, delay)
+        await asyncio.sleep(delay)
+
+async def generate_with_retry(model, prompt: str):
+    """Send a prompt to the model through call_with_retry."""
+    return await call_with_retry(lambda: model.generate_content_async(prompt))
 
 def estimate_token_count(text: str) -> int:
     """Roughly estimate token count from text."""
     return len(text) // 2
 
-def create_batches(sections: List[str], token_limit: int = 5000) -> List[List[str]]:
+async def count_tokens_async(model, sections: Iterable[str], cache=None) -> Dict[str, int]:
     """
-    Group sections into batches to optimize API calls.
-    Each batch should be under the token_limit.
+    Count the tokens of each distinct section with the model's tokenizer.
+    Requests run concurrently through call_with_retry, and the rough estimate
+    is used only for a section whose count still fails after retries.
+    
+    If a cache is given, counts from earlier runs are reused and new counts
+    are stored in it, so a rerun does not count its sections again.
     """
-    batches = []
-    current_batch = []
-    current_tokens = 0
+    async def count(text: str) -> int:
+        key = token_count_key(model, text)
+        if cache is not None and key in cache:
+            return cache[key]
+        try:
+            tokens = (await call_with_retry(lambda: model.count_tokens_async(text))).total_tokens
+        except Exception as e:
+            logger.warning("Error counting tokens, using estimate: %s", e)
+            return estimate_token_count(text)
+        if cache is not None:
+            cache[key] = tokens
+        return tokens
     
-    for section in sections:
-        section_tokens = estimate_token_count(section)
-        
-        # If adding this section exceeds the token limit and we already have sections in the batch
-        if current_tokens + section_tokens > token_limit and current_batch:
-            batches.append(current_batch)
-            current_batch = [section]
-            current_tokens = section_tokens
+    texts = list(dict.fromkeys(sections))
+    return dict(zip(texts, await asyncio.gather(*[count(text) for text in texts])))
+
+# Input tokens per batch. The translated output of a batch must fit in the
+# model's output limit (8192 tokens for gemini-2.0-flash), so this stays well
+# below the input context window.
+BATCH_TOKEN_LIMIT = 5000
+
+# Sections are only packed together within runs of consecutive sections of
+# about this many batches' worth of tokens, so the sections of a batch stay
+# close to each other in the input
+PACKING_WINDOW = 8
+
+def pack_sections(indices: List[int], tokens: List[int], token_limit: int) -> List[List[int]]:
+    """
+    Pack the sections at the given indices first-fit-decreasing: largest
+    first, each into the first batch with room left.
+    """
+    batches: List[List[int]] = []
+    batch_tokens: List[int] = []
+    
+    for index in sorted(indices, key=lambda i: -tokens[i]):
+        section_tokens = tokens[index]
+        for b, current_tokens in enumerate(batch_tokens):
+            if current_tokens + section_tokens <= token_limit:
+                batches[b].append(index)
+                batch_tokens[b] += section_tokens
+                break
         else:
-            current_batch.append(section)
-            current_tokens += section_tokens
+            # No batch has room (or the section alone exceeds the limit)
+            batches.append([index])
+            batch_tokens.append(section_tokens)
+    
+    # Restore the logical order of the sections
+    for batch in batches:
+        batch.sort()
+    batches.sort(key=lambda batch: batch[0])
+    return batches
+
+def create_batches(sections: Iterable[str], token_limit: int = BATCH_TOKEN_LIMIT,
+                   count_tokens: Callable[[str], int] = estimate_token_count) -> List[List[int]]:
+    """
+    Group sections into batches to optimize API calls.
+    Each batch should be under the token_limit, as measured by count_tokens.
+    Returns the indices of the sections in each batch.
     
-    # Add the last batch if it's not empty
-    if current_batch:
-        batches.append(current_batch)
+    The sections are split into windows of consecutive sections holding
+    about PACKING_WINDOW batches' worth of tokens, and each window is packed
+    first-fit-decreasing. Sections keep their original order within a batch,
+    and batches are ordered by their first section.
+    """
+    tokens = [count_tokens(section) for section in sections]
+    window_limit = PACKING_WINDOW * token_limit
+    
+    batches: List[List[int]] = []
+    window: List[int] = []
+    window_tokens = 0
+    for index, section_tokens in enumerate(tokens):
+        if window and window_tokens + section_tokens > window_limit:
+            batches.extend(pack_sections(window, tokens, token_limit))
+            window, window_tokens = [], 0
+        window.append(index)
+        window_tokens += section_tokens
+    batches.extend(pack_sections(window, tokens, token_limit))
     
     return batches
 
-def translate_batch(model, batch: List[str]) -> List[str]:
+def cache_key(model, text: str) -> str:
+    """Key for the translation of a text by the given model in the cache."""
+    return hashlib.sha256((model.model_name + "\0" + text).encode('utf-8')).hexdigest()
+
+def token_count_key(model, text: str) -> str:
+    """Key for the token count of a text with the given model in the cache."""
+    return "tokens:" + cache_key(model, text)
+
+async def translate_batch_async(model, batch: List[str], cache=None) -> List[str]:
     """
     Translate a batch of sections while preserving section boundaries.
     Returns a list of translated sections.
+    
+    If the request still fails after retries, or the translation does not
+    split into one section per input section, the batch is split in half and
+    each half is translated separately, so that at most the failing sections
+    are marked as errors.
+    
+    If a cache is given, sections and batches translated before are reused
+    and new translations are stored in it.
     """
-    # Create a unique separator that's unlikely to appear in the text
-    section_separator = "[SECTION_BREAK]"
+    if cache is not None:
+        # Only translate the sections that are not cached yet
+        cached = [cache.get(cache_key(model, section)) for section in batch]
+        missing = [section for section, translated in zip(batch, cached) if translated is None]
+        if not missing:
+            return cached
+        if len(missing) < len(batch):
+            new_translations = iter(await translate_batch_async(model, missing, cache))
+            return [translated if translated is not None else next(new_translations, "[Translation Error]")
+                    for translated in cached]
     
     # Join sections with the separator for batch processing
-    batch_text = f"{section_separator}\n".join(batch)
+    batch_text = _JOIN_SEP.join(batch)
+    
+    key = cache_key(model, batch_text)
     
     try:
-        prompt = f"""You are a professional translator.
-
-TASK: Translate the Chinese text to English. This is VERY IMPORTANT.
-
-The text contains multiple sections separated by [SECTION_BREAK].
-
-Specific Translation Requirements:
-1. TRANSLATE FROM CHINESE TO ENGLISH. Do not keep any Chinese characters in your response.
-2. Translate EVERY SINGLE WORD from Chinese to English.
-3. Maintain all [SECTION_BREAK] separators exactly as they appear.
-4. Do not add or remove any section breaks.
-5. If you see Chinese text, you MUST translate it to English.
-
-TEXT TO TRANSLATE (CHINESE → ENGLISH):
-{batch_text}
-
-IMPORTANT: Your response must be ENTIRELY in English.
-"""
-        response = model.generate_content(prompt)
-        translation = response.text.strip()
-        
-        # Remove any explanatory text the model might have added
-        if translation.startswith("Translation:"):
-            translation = translation[len("Translation:"):].strip()
-        
-        # Debug: Print a sample of the translation to check if it's in English
-        sample_translation = translation[:100] + "..." if len(translation) > 100 else translation
-        print(f"Sample translation: {sample_translation}")
+        if cache is not None and key in cache:
+            translation = cache[key]
+        else:
+            prompt = _PROMPT_PREFIX + batch_text + _PROMPT_SUFFIX
+            response = await generate_with_retry(model, prompt)
+            translation = response.text.strip()
+            
+            # Remove any explanatory text the model might have added
+            translation = translation.removeprefix("Translation:").lstrip()
         
-        # Split the translation back into sections
-        translated_sections = translation.split(f"{section_separator}")
+        # Debug: Log a sample of the translation to check if it's in English
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Sample translation: %.100s...", translation)
         
-        # Clean up each section
-        translated_sections = [section.strip() for section in translated_sections]
+        # Split the translation back into sections, stripping each one
+        translated_sections = _SEP_RE.split(translation)
         
         # Ensure we have the same number of sections as in the batch
         if len(translated_sections) != len(batch):
-            print(f"Warning: Number of translated sections ({len(translated_sections)}) doesn't match input ({len(batch)})")
-            # # If we have fewer sections than expected, we need to pad the list
-            # if len(translated_sections) < len(batch):
-            #     translated_sections.extend(["[Translation Error]"] * (len(batch) - len(translated_sections)))
-            # # If we have more sections than expected, truncate the list
-            # else:
-            #     translated_sections = translated_sections[:len(batch)]
+            logger.warning("Number of translated sections (%d) doesn't match input (%d)", len(translated_sections), len(batch))
+            if cache is not None:
+                # Drop a mismatched translation cached by an earlier version
+                cache.pop(key, None)
+            if len(batch) > 1:
+                return await translate_halves(model, batch, cache)
+            return [await translate_single_section(model, batch[0], cache)]
+        
+        if cache is not None:
+            # Cache the batch only once it splits correctly, and each section too
+            # so it can be reused in a differently composed batch
+            cache[key] = translation
+            for section, translated in zip(batch, translated_sections):
+                cache[cache_key(model, section)] = translated
         
         return translated_sections
     except Exception as e:
-        print(f"Error during batch translation: {e}")
-        # Return error placeholder for each section in the batch
-        return ["[Translation Error]"] * len(batch)
+        logger.error("Error during batch translation: %s", e)
+        if len(batch) > 1:
+            return await translate_halves(model, batch, cache)
+        # Return error placeholder for the section
+        return ["[Translation Error]"]
+
+async def translate_halves(model, batch: List[str], cache=None) -> List[str]:
+    """Translate each half of a batch on its own to isolate the sections that fail."""
+    mid = len(batch) // 2
+    logger.info("Splitting batch of %d sections and retrying each half", len(batch))
+    left = await translate_batch_async(model, batch[:mid], cache)
+    right = await translate_batch_async(model, batch[mid:], cache)
+    return left + right
 
-def main():
+async def translate_single_section(model, section: str, cache=None) -> str:
+    """Translate one section with a prompt that asks for exactly one translation."""
+    try:
+        response = await generate_with_retry(model, _SINGLE_PROMPT_PREFIX + section + _PROMPT_SUFFIX)
+        translation = response.text.strip().removeprefix("Translation:").lstrip()
+    except Exception as e:
+        logger.error("Error during section translation: %s", e)
+        return "[Translation Error]"
+    
+    # Keep any pieces the model still split as one section
+    translation = "\n".join(_SEP_RE.split(translation))
+    if cache is not None:
+        cache[cache_key(model, section)] = translation
+    return translation
+
+class OrderedSectionWriter:
+    """
+    Appends translated sections to one open file in their original order,
+    whatever order their batches finish in. Sections that finish early wait
+    in memory until all sections before them are written.
+    
+    At most `window` batches past the batch of the next section to write are
+    let through wait_for_room(), which bounds the sections held in memory.
+    """
+    def __init__(self, f, batches: List[List[int]], window: int):
+        self.f = f
+        self.window = window
+        # Batch number of each section
+        self.section_batch = [0] * sum(len(batch) for batch in batches)
+        for batch_num, batch in enumerate(batches, 1):
+            for index in batch:
+                self.section_batch[index] = batch_num
+        self.next_section = 0
+        self.pending: Dict[int, str] = {}
+        self.lock = asyncio.Lock()
+        self.room = asyncio.Condition(self.lock)
+    
+    def _has_room(self, batch_num: int) -> bool:
+        if self.next_section == len(self.section_batch):
+            return True
+        return batch_num < self.section_batch[self.next_section] + self.window
+    
+    async def wait_for_room(self, batch_num: int) -> None:
+        """Wait until batch_num is within the window of the next section's batch."""
+        async with self.room:
+            await self.room.wait_for(lambda: self._has_room(batch_num))
+    
+    async def write(self, indices: List[int], translated_batch: List[str]) -> None:
+        async with self.room:
+            self.pending.update(zip(indices, translated_batch))
+            sections = []
+            while self.next_section in self.pending:
+                sections.append(self.pending.pop(self.next_section))
+                self.next_section += 1
+            if sections:
+                # Separate sections with '---', including across writes
+                separator = '\n---\n' if self.next_section > len(sections) else ''
+                await self.f.write(separator + '\n---\n'.join(sections))
+            self.room.notify_all()
+
+async def translate_and_save(model, sections: List[str], indices: List[int], batch_num: int,
+                             writer: OrderedSectionWriter, cache=None) -> Tuple[int, int]:
+    """
+    Translate the sections at the given indices as one batch and hand them to
+    the writer without blocking the event loop.
+    Returns the batch number and the number of sections translated.
+    """
+    batch = [sections[i] for i in indices]
+    logger.info("Translating batch %d (%d sections)...", batch_num, len(batch))
+    try:
+        translated_batch = await translate_batch_async(model, batch, cache)
+    except Exception as e:
+        # Still hand the batch to the writer so later sections are not held back
+        logger.error("Error translating batch %d: %s", batch_num, e)
+        translated_batch = ["[Translation Error]"] * len(batch)
+    
+    await writer.write(indices, translated_batch)
+    return batch_num, len(translated_batch)
+
+def positive_int(value: str) -> int:
+    """argparse type for options that must be a positive integer."""
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {value}")
+    return number
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Translate the processed Chinese text to English with Gemini')
+    parser.add_argument('--input', required=True,
+                        help="Processed text file with sections separated by '---'")
+    parser.add_argument('--output-dir', required=True,
+                        help=f"Directory to write '{output_name}' to")
+    parser.add_argument('--model', default=DEFAULT_MODEL,
+                        help=f"Gemini model to translate with (default: {DEFAULT_MODEL})")
+    parser.add_argument('--concurrency', type=positive_int, default=DEFAULT_CONCURRENCY,
+                        help=f"Maximum number of requests in flight (default: {DEFAULT_CONCURRENCY})")
+    parser.add_argument('--qpm', type=positive_int, default=DEFAULT_QPM,
+                        help=f"Maximum number of requests started per minute (default: {DEFAULT_QPM})")
+    return parser.parse_args()
+
+async def main(args):
+    global SEM, BUCKET
+    
     # Check for API key
     api_key = os.getenv('GOOGLE_API_KEY')
     if not api_key:
-        print("Please set your Google API key as an environment variable 'GOOGLE_API_KEY'")
+        logger.error("Please set your Google API key as an environment variable 'GOOGLE_API_KEY'")
         return
 
-    # Configure the Gemini API
-    genai.configure(api_key=api_key)
+    # Configure the Gemini API. The asyncio gRPC transport keeps all requests
+    # on one long-lived channel that the model's async calls share.
+    genai.configure(api_key=api_key, transport="grpc_asyncio")
     
     # Create the Gemini model
     generation_config = {
@@ -136,54 +465,84 @@ def main():
     }
     
     model = genai.GenerativeModel(
-        model_name="gemini-2.0-flash", 
+        model_name=args.model, 
         generation_config=generation_config
     )
     
+    # Limit requests to the configured concurrency and rate
+    SEM = asyncio.Semaphore(args.concurrency)
+    BUCKET = RequestBucket(args.qpm)
+    
     # Ensure output directory exists
-    os.makedirs(output_dir, exist_ok=True)
+    os.makedirs(args.output_dir, exist_ok=True)
     
-    # Read and process the text
-    content = read_text_file(input_file)
-    sections = split_into_sections(content)
-    total_sections = len(sections)
+    output_file = os.path.join(args.output_dir, output_name)
     
-    print(f"Found {total_sections} sections. Creating batches for efficient processing...")
+    # Reuse token counts and translations from earlier runs
+    with shelve.open(cache_file) as cache:
+        await translate_file(model, args, output_file, cache)
     
-    # Create batches of sections
-    batches = create_batches(sections)
+    logger.info("Translation completed! All batches saved to: %s", output_file)
+
+async def translate_file(model, args, output_file: str, cache) -> None:
+    """Translate the sections of args.input and append them in order to output_file."""
+    # Read the sections and create batches of them
+    sections = list(iter_sections(args.input))
+    token_counts = await count_tokens_async(model, sections, cache)
+    batches = create_batches(sections, count_tokens=token_counts.__getitem__)
+    total_sections = sum(len(batch) for batch in batches)
     total_batches = len(batches)
     
-    print(f"Created {total_batches} batches for processing.")
+    logger.info("Found %d sections. Created %d batches for processing.", total_sections, total_batches)
+    
+    logger.info("Translating %d batches concurrently...", total_batches)
+    flush_logs()
     
     sections_completed = 0
     
-    for i, batch in enumerate(batches):
-        batch_num = i + 1
-        batch_output_file = os.path.join(output_dir, f"{output_base}_{batch_num:03d}.txt")
-        
-        print(f"Translating batch {batch_num} of {total_batches} ({len(batch)} sections)...")
-        
-        # Translate the batch
-        translated_batch = translate_batch(
-            model,
-            batch
-        )
-        
-        # Save the translated batch to a separate file
-        with open(batch_output_file, 'w', encoding='utf-8') as f:
-            f.write('\n---\n'.join(translated_batch))
-        
-        sections_completed += len(translated_batch)
-        print(f"Saved batch {batch_num} to file: {batch_output_file}")
-        print(f"Progress: {sections_completed}/{total_sections} sections completed.")
-        
-        # Add a small delay to avoid potential rate limiting
-        if i < total_batches - 1:
-            print(f"Sleeping for 10 seconds...")
-            time.sleep(10)
+    # Batches are handed to the workers through a bounded queue, so only a
+    # few batches beyond those being translated are queued at any time. The
+    # producer also waits for the writer, so a slow early batch holds back
+    # new work instead of letting finished sections pile up behind it.
+    # All sections are still read up front, as the packing needs them.
+    queue: asyncio.Queue = asyncio.Queue(maxsize=args.concurrency * 2)
     
-    print(f"Translation completed! All batches saved to separate files in: {output_dir}")
+    async def produce(writer):
+        for i, batch in enumerate(batches):
+            await writer.wait_for_room(i + 1)
+            await queue.put((i + 1, batch))
+        # One sentinel per worker to stop it
+        for _ in range(args.concurrency):
+            await queue.put(None)
+    
+    async def work(writer, cache):
+        nonlocal sections_completed
+        while (item := await queue.get()) is not None:
+            batch_num, indices = item
+            # Translation errors are written as placeholders by translate_and_save,
+            # so every batch reaches the writer. Only a failed write is raised,
+            # which stops the run rather than reporting an incomplete file.
+            batch_num, translated_sections = await translate_and_save(model, sections, indices, batch_num, writer, cache)
+            sections_completed += translated_sections
+            logger.info("Translated batch %d of %d", batch_num, total_batches)
+            logger.info("Progress: %d/%d sections completed.", sections_completed, total_sections)
+            # Report progress once per batch, with the records of that batch in one burst
+            flush_logs()
+    
+    # Translate all batches concurrently and append the sections in their
+    # original order to a single output file
+    async with aiofiles.open(output_file, 'w', encoding='utf-8') as f:
+        writer = OrderedSectionWriter(f, batches, window=args.concurrency * 4)
+        await asyncio.gather(produce(writer), *[work(writer, cache) for _ in range(args.concurrency)])
+        
+        # Make the output durable once, after all batches are written
+        await f.flush()
+        os.fsync(f.fileno())
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    args = parse_args()
+    setup_logging()
+    if uvloop is not None:
+        uvloop.run(main(args))
+    else:
+        asyncio.run(main(args)) 
\ No newline at end of file